@@ -2,15 +2,73 @@
 # Release under the simplified BSD license.  See LICENSE for details.
 
 import argparse
+from errno import ENOBUFS
+from errno import ENOENT
+from errno import ESRCH
 from ipaddress import IPv4Interface
+import logging
+import os
 import re
+import select
 from socket import AF_INET
+from socket import SOL_SOCKET
+from socket import SO_RCVBUF
 import sys
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
 
 import pyroute2
-from pyroute2.netlink.rtnl import RTNLGRP_IPV4_IFADDR
-from pyroute2.netlink.rtnl import RTNLGRP_LINK
-from pyroute2.netlink.rtnl import RTNLGRP_IPV4_ROUTE
+from pyroute2.netlink import NLM_F_ACK
+from pyroute2.netlink import NLM_F_CREATE
+from pyroute2.netlink import NLM_F_EXCL
+from pyroute2.netlink import NLM_F_REQUEST
+from pyroute2.netlink.rtnl import RTM_DELROUTE
+from pyroute2.netlink.rtnl import RTM_DELRULE
+from pyroute2.netlink.rtnl import RTM_NEWROUTE
+from pyroute2.netlink.rtnl import RTM_NEWRULE
+from pyroute2.netlink.rtnl import RTMGRP_IPV4_IFADDR
+from pyroute2.netlink.rtnl import RTMGRP_IPV4_ROUTE
+from pyroute2.netlink.rtnl import RTMGRP_IPV4_RULE
+from pyroute2.netlink.rtnl import RTMGRP_LINK
+from pyroute2.netlink.rtnl import rt_proto
+from pyroute2.netlink.rtnl import rt_scope
+from pyroute2.netlink.rtnl import rt_type
+from pyroute2.netlink.rtnl.fibmsg import fibmsg
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+
+
+log = logging.getLogger(__name__)
+
+# A decoded pyroute2 netlink message.
+Msg = Any
+# (msg, msg_type, msg_flags), as taken by nl_batch().
+Request = Tuple[Any, int, int]
+# accept_<event> filters and recv_<event> handlers.
+Accept = Callable[[Msg], bool]
+Handler = Callable[[str, 'AttrView', Msg], None]
+
+# linux/fib_rules.h
+FR_ACT_TO_TBL = 1
+# linux/rtnetlink.h, tables above 255 are only given in the TABLE attribute.
+RT_TABLE_COMPAT = 252
+
+
+def rt_table_header(table: int) -> int:
+    """Table number for a rule or route header, see RT_TABLE_COMPAT."""
+    return table if table <= 255 else RT_TABLE_COMPAT
+
+
+# asm-generic/socket.h, not exported by the socket module.
+SO_RCVBUFFORCE = 33
+
+# Large enough to absorb bursts of link/addr/route changes.
+MONITOR_RCVBUF = 8 * 1024 * 1024
 
 
 def main():
@@ -26,6 +84,9 @@ def main():
     parser.add_argument(
             '--rt-table-base', metavar='TABLE', type=int, default=10000,
             help='Generate route tables starting at TABLE.')
+    parser.add_argument(
+            '--verbose', '-v', action='count', default=0,
+            help='Log changes, repeat to also log netlink events.')
     parser.add_argument(
             '--pdb', action='store_true',
             help='Enter pdb when it breaks.')
@@ -42,44 +103,30 @@ def main():
 
     args = parser.parse_args()
 
-    route_state_class = NLSymmetricRouteState
-    if args.command == 'reset':
-        route_state_class = NLResetSymmetricRouteState
+    logging.basicConfig(
+            format='%(levelname)s %(message)s',
+            level=[logging.WARNING, logging.INFO, logging.DEBUG][
+                min(args.verbose, 2)])
+
+    runner_class = RUNNERS[args.command]
 
-    link_state = NLLinkState()
-    route_state = route_state_class(
+    ipr = pyroute2.IPRoute()
+    link_state = NLLinkState(if_pattern=args.if_pattern)
+    route_state = runner_class.route_state_class(
             link_state,
-            if_pattern=args.if_pattern,
+            ipr=ipr,
             rt_table_base=args.rt_table_base,
             rule_priority_base=args.rule_priority_base)
-
-    def recv(msg):
-        link_state.recv(msg)
-        route_state.recv(msg)
+    runner = runner_class(link_state, route_state)
 
     try:
-        if args.command == 'monitor':
-            monitor = pyroute2.IPRoute()
-            monitor.bind(
-                    RTNLGRP_LINK|RTNLGRP_IPV4_IFADDR|RTNLGRP_IPV4_ROUTE,
-                    async=True)
-            def forward_recv(msg):
-                monitor.buffer_queue.put(msg.raw)
-            real_recv, recv = recv, forward_recv
-
-        with pyroute2.IPRoute() as ipr:
-            for msg in ipr.get_links(): recv(msg)
-            for msg in ipr.get_addr(AF_INET): recv(msg)
-            for msg in ipr.get_routes(AF_INET): recv(msg)
-
-        if args.command == 'monitor':
-            try:
-                while True:
-                    for msg in monitor.get(): real_recv(msg)
+        runner.bootstrap(ipr)
+        try:
+            runner.loop()
 
-            except KeyboardInterrupt:
-                # This is how processes that run forever "normally exit".
-                pass
+        except KeyboardInterrupt:
+            # This is how processes that run forever "normally exit".
+            pass
 
     except Exception:
         if args.pdb:
@@ -88,72 +135,170 @@ def main():
         else:
             raise
 
+    finally:
+        runner.close()
+        route_state.close()
+
 
 class NLState:
-    def recv(self, msg):
+    def __init__(self) -> None:
+        # Map event names to their recv_<event> handlers, and to the
+        # optional accept_<event> filters that run before attributes are
+        # looked at.  Messages are delivered by NLDispatcher.
+        self.handlers = {
+                name[len('recv_'):]: getattr(self, name)
+                for name in dir(self) if name.startswith('recv_')
+        }  # type: Dict[str, Handler]
+        self.filters = {
+                name[len('accept_'):]: getattr(self, name)
+                for name in dir(self) if name.startswith('accept_')
+        }  # type: Dict[str, Accept]
+
+    def _accept_inet(self, msg: Msg) -> bool:
+        return msg['family'] == AF_INET
+
+
+class NLDispatcher:
+    """Fan netlink messages out to several states in order.
+
+    The event lookup and attribute view are shared by all handlers of a
+    message.
+    """
+    def __init__(self, *states: NLState) -> None:
+        self.handlers = {
+        }  # type: Dict[str, List[Tuple[Optional[Accept], Handler]]]
+        for state in states:
+            for event, method in state.handlers.items():
+                self.handlers.setdefault(event, []).append(
+                        (state.filters.get(event), method))
+
+    def recv(self, msg: Msg) -> None:
         event = msg['event']
-        method = getattr(self, 'recv_{}'.format(event), None)
-        if method is None:
+        handlers = self.handlers.get(event)
+        if handlers is None:
             return
-        attrs = dict(msg['attrs'])
-        method(event, attrs, msg)
+        attrs = None
+        for accept, method in handlers:
+            if accept is not None and not accept(msg):
+                continue
+            if attrs is None:
+                attrs = AttrView(msg['attrs'])
+            method(event, attrs, msg)
+
+
+class AttrView:
+    """Read-only mapping over a netlink attribute list.
+
+    Handlers only look at a few attributes, so scanning the short list on
+    demand is cheaper than building a dict for every message.
+    """
+    __slots__ = ('attrs',)
+
+    def __init__(self, attrs: Iterable[Tuple[str, Any]]) -> None:
+        self.attrs = attrs
+
+    def __getitem__(self, key: str) -> Any:
+        for name, value in self.attrs:
+            if name == key:
+                return value
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        for name, value in self.attrs:
+            if name == key:
+                return value
+        return default
 
 
 class NLLinkState(NLState):
-    def __init__(self):
-        self.links = {}
+    def __init__(self, *, if_pattern: str) -> None:
+        super().__init__()
+        self.links = {}  # type: Dict[int, Link]
+        self._if_re = re.compile(if_pattern)
 
-    def __getitem__(self, index):
+    def reset(self) -> None:
+        self.links.clear()
+
+    def __getitem__(self, index: int) -> 'Link':
         return self.links[index]
 
-    def recv_RTM_NEWLINK(self, ev, attrs, msg):
+    def get(self, index: int,
+            default: 'Optional[Link]' = None) -> 'Optional[Link]':
+        return self.links.get(index, default)
+
+    def recv_RTM_NEWLINK(self, ev: str, attrs: AttrView, msg: Msg) -> None:
         index = msg['index']
         ifname = attrs['IFLA_IFNAME']
-        print('Adding link {} #{}'.format(ifname, index))
+        log.debug('Adding link %s #%d', ifname, index)
         if index not in self.links:
             self.links[index] = Link()
-        self.links[index].update(name=ifname)
+        link = self.links[index]
+        if link.name != ifname:
+            link.update(name=ifname)
+            link.matches_pattern = bool(self._if_re.fullmatch(ifname))
 
-    def recv_RTM_DELLINK(self, ev, attrs, msg):
+    def recv_RTM_DELLINK(self, ev: str, attrs: AttrView, msg: Msg) -> None:
+        # Updates held back during a dump may already be reflected in it,
+        # so unknown links and addresses are skipped here and below.
         index = msg['index']
-        link = self.links[index]
-        print('Dropping link {} #{}'.format(link.name, index))
-        del self.links[index]
+        link = self.links.pop(index, None)
+        if link is None:
+            return
+        log.debug('Dropping link %s #%d', link.name, index)
+
+    accept_RTM_NEWADDR = accept_RTM_DELADDR = NLState._accept_inet
 
-    def recv_RTM_NEWADDR(self, ev, attrs, msg):
-        if msg['family'] != AF_INET: return
+    def recv_RTM_NEWADDR(self, ev: str, attrs: AttrView, msg: Msg) -> None:
         index = msg['index']
-        link = self.links[index]
-        addr = IPv4Interface(
-                '{}/{}'.format(attrs['IFA_ADDRESS'], msg['prefixlen']))
-        print('Adding addr {} for {} #{}'.format(addr, link.name, index))
+        link = self.links.get(index)
+        if link is None:
+            return
+        addr = IPv4Interface((attrs['IFA_ADDRESS'], msg['prefixlen']))
+        log.debug('Adding addr %s for %s #%d', addr, link.name, index)
         link.addrs.add(addr)
+        if link.primary_addr is None:
+            link.primary_addr = addr
 
-    def recv_RTM_DELADDR(self, ev, attrs, msg):
-        if msg['family'] != AF_INET: return
+    def recv_RTM_DELADDR(self, ev: str, attrs: AttrView, msg: Msg) -> None:
         index = msg['index']
-        link = self.links[index]
-        addr = IPv4Interface(
-                '{}/{}'.format(attrs['IFA_ADDRESS'], msg['prefixlen']))
-        print('Dropping addr {} for {} #{}'.format(addr, link.name, index))
-        link.addrs.remove(addr)
+        link = self.links.get(index)
+        if link is None:
+            return
+        addr = IPv4Interface((attrs['IFA_ADDRESS'], msg['prefixlen']))
+        log.debug('Dropping addr %s for %s #%d', addr, link.name, index)
+        link.addrs.discard(addr)
+        if link.primary_addr == addr:
+            link.primary_addr = next(iter(link.addrs), None)
 
 
 class NLSymmetricRouteState(NLState):
-    def __init__(self, links, *, if_pattern, rt_table_base, rule_priority_base):
+    def __init__(self, links: NLLinkState, *, ipr: Any,
+            rt_table_base: int, rule_priority_base: int) -> None:
+        super().__init__()
         self.links = links
-        self.if_pattern = if_pattern
+        self.ipr = ipr
         self.rt_table_base = rt_table_base
         self.rule_priority_base = rule_priority_base
+        # Rule priorities in use, kept in sync with RTM_NEWRULE/DELRULE.
+        self._installed_priorities = set()  # type: Set[int]
 
-    def recv_RTM_NEWROUTE(self, ev, attrs, msg):
-        if msg['family'] != AF_INET: return
-        # Ignore link local routes and other interfaces
-        if msg['table'] != 254:
-            return
-        if_index = attrs['RTA_OIF']
-        link = self.links[if_index]
-        if not re.fullmatch(self.if_pattern, link.name):
+    def close(self) -> None:
+        self.ipr.close()
+
+    def reset(self) -> None:
+        self._installed_priorities.clear()
+
+    def _accept_main_inet(self, msg: Msg) -> bool:
+        # Ignore link local routes and other tables
+        return msg['family'] == AF_INET and msg['table'] == 254
+
+    accept_RTM_NEWROUTE = accept_RTM_DELROUTE = _accept_main_inet
+    accept_RTM_NEWRULE = accept_RTM_DELRULE = NLState._accept_inet
+
+    def recv_RTM_NEWROUTE(self, ev: str, attrs: AttrView, msg: Msg) -> None:
+        # Ignore other interfaces, including ones we haven't seen yet.
+        link = self.links.get(attrs.get('RTA_OIF'))
+        if link is None or not link.matches_pattern:
             return
 
         # Look for default routes.
@@ -162,14 +307,10 @@ class NLSymmetricRouteState(NLState):
 
         self.add_symmetric_route(attrs)
 
-    def recv_RTM_DELROUTE(self, ev, attrs, msg):
-        if msg['family'] != AF_INET: return
-        # Ignore link local routes and other interfaces
-        if msg['table'] != 254:
-            return
-        if_index = attrs['RTA_OIF']
-        link = self.links[if_index]
-        if not re.fullmatch(self.if_pattern, link.name):
+    def recv_RTM_DELROUTE(self, ev: str, attrs: AttrView, msg: Msg) -> None:
+        # Ignore other interfaces, including ones we haven't seen yet.
+        link = self.links.get(attrs.get('RTA_OIF'))
+        if link is None or not link.matches_pattern:
             return
 
         # Look for default routes.
@@ -178,77 +319,284 @@ class NLSymmetricRouteState(NLState):
 
         self.del_symmetric_route(attrs)
 
-    def add_symmetric_route(self, attrs):
+    def recv_RTM_NEWRULE(self, ev: str, attrs: AttrView, msg: Msg) -> None:
+        self._installed_priorities.add(attrs.get('FRA_PRIORITY', 0))
+
+    def recv_RTM_DELRULE(self, ev: str, attrs: AttrView, msg: Msg) -> None:
+        self._installed_priorities.discard(attrs.get('FRA_PRIORITY', 0))
+
+    def add_symmetric_route(self, attrs: AttrView) -> None:
         if_index = attrs['RTA_OIF']
         link = self.links[if_index]
         priority = self.rule_priority_base + if_index
         table = self.rt_table_base + if_index
-        addr = first(link.addrs)
+        addr = link.primary_addr
         gw = attrs['RTA_GATEWAY']
+        if addr is None:
+            log.warning('No address for %s, skipping default route', link.name)
+            return
 
-        with pyroute2.IPRoute() as ipr:
-            print('Checking for rules for default route for', link.name)
-            if not ipr.get_rules(AF_INET, priority=priority):
-                print('Setting up route/rule for', link.name, table, priority)
-
-                ipr.rule('add',
-                        priority=priority,
-                        src=str(addr.network.network_address),
-                        src_len=addr.network.prefixlen,
-                        action='FR_ACT_TO_TBL',
-                        table=table)
-
-                ipr.route('add',
-                        dst='0.0.0.0', mask=0,
-                        gateway=gw,
-                        oif=if_index,
-                        prefsrc=str(addr.ip),
-                        table=table)
-
-    def del_symmetric_route(self, attrs):
+        log.debug('Checking for rules for default route for %s', link.name)
+        if priority not in self._installed_priorities:
+            log.info('Setting up route/rule for %s %d %d',
+                    link.name, table, priority)
+
+            rule = fibmsg()
+            rule['family'] = AF_INET
+            rule['src_len'] = addr.network.prefixlen
+            rule['table'] = rt_table_header(table)
+            rule['action'] = FR_ACT_TO_TBL
+            rule['attrs'] = [
+                    ['FRA_PRIORITY', priority],
+                    ['FRA_SRC', str(addr.network.network_address)],
+                    ['FRA_TABLE', table]]
+
+            route = rtmsg()
+            route['family'] = AF_INET
+            route['dst_len'] = 0
+            route['table'] = rt_table_header(table)
+            route['proto'] = rt_proto['static']
+            route['scope'] = rt_scope['universe']
+            route['type'] = rt_type['unicast']
+            route['attrs'] = [
+                    ['RTA_GATEWAY', gw],
+                    ['RTA_OIF', if_index],
+                    ['RTA_PREFSRC', str(addr.ip)],
+                    ['RTA_TABLE', table]]
+
+            flags = NLM_F_REQUEST|NLM_F_ACK|NLM_F_CREATE|NLM_F_EXCL
+            self.submit([
+                    (rule, RTM_NEWRULE, flags),
+                    (route, RTM_NEWROUTE, flags)])
+            self._installed_priorities.add(priority)
+
+    def del_symmetric_route(self, attrs: AttrView) -> None:
         if_index = attrs['RTA_OIF']
         link = self.links[if_index]
         priority = self.rule_priority_base + if_index
         table = self.rt_table_base + if_index
-        addr = first(link.addrs)
-        gw = attrs['RTA_GATEWAY']
 
-        with pyroute2.IPRoute() as ipr:
-            print('Checking for rules for default route for', link.name)
-            if ipr.get_rules(AF_INET, priority=priority):
-                print('Tearing down route/rule for', link.name, table, priority)
-
-                ipr.flush_rules(priority=priority)
-                ipr.flush_routes(table=table)
+        log.debug('Checking for rules for default route for %s', link.name)
+        if priority in self._installed_priorities:
+            log.info('Tearing down route/rule for %s %d %d',
+                    link.name, table, priority)
+
+            rule = fibmsg()
+            rule['family'] = AF_INET
+            rule['table'] = rt_table_header(table)
+            rule['attrs'] = [
+                    ['FRA_PRIORITY', priority],
+                    ['FRA_TABLE', table]]
+
+            # Only the default route we installed is removed, other routes
+            # someone else put in this table are left alone.
+            route = rtmsg()
+            route['family'] = AF_INET
+            route['dst_len'] = 0
+            route['table'] = rt_table_header(table)
+            route['scope'] = rt_scope['nowhere']
+            route['attrs'] = [
+                    ['RTA_TABLE', table]]
+
+            # Either may already be gone along with the link.
+            flags = NLM_F_REQUEST|NLM_F_ACK
+            self.submit([
+                    (rule, RTM_DELRULE, flags),
+                    (route, RTM_DELROUTE, flags)],
+                    ignore=(ENOENT, ESRCH))
+            self._installed_priorities.discard(priority)
+
+    def submit(self, requests: Iterable[Request], *,
+            ignore: Iterable[int] = ()) -> None:
+        nl_batch(self.ipr, requests, ignore=ignore)
+
+    def commit(self) -> None:
+        # Requests are sent as soon as they are submitted.
+        pass
 
 
 class NLResetSymmetricRouteState(NLSymmetricRouteState):
-    def recv_RTM_NEWROUTE(self, *a):
+    def __init__(self, *a: Any, **kw: Any) -> None:
+        super().__init__(*a, **kw)
+        self.pending = []  # type: List[Request]
+        self.pending_ignore = set()  # type: Set[int]
+
+    def submit(self, requests: Iterable[Request], *,
+            ignore: Iterable[int] = ()) -> None:
+        # Everything is known after the initial dump, so hold requests
+        # back and send them all at once from commit().
+        self.pending.extend(requests)
+        self.pending_ignore.update(ignore)
+
+    def commit(self) -> None:
+        requests, self.pending = self.pending, []
+        ignore, self.pending_ignore = self.pending_ignore, set()
+        nl_batch(self.ipr, requests, ignore=tuple(ignore))
+
+    def recv_RTM_NEWROUTE(self, *a: Any) -> None:
         super().recv_RTM_DELROUTE(*a)
 
-    def recv_RTM_DELROUTE(self, *a):
+    def recv_RTM_DELROUTE(self, *a: Any) -> None:
         super().recv_RTM_NEWROUTE(*a)
 
 
+class OnceRunner:
+    route_state_class = NLSymmetricRouteState  # type: type
+
+    def __init__(self, link_state: NLLinkState,
+            route_state: NLSymmetricRouteState) -> None:
+        self.link_state = link_state
+        self.route_state = route_state
+        self.recv = NLDispatcher(link_state, route_state).recv
+
+    def dump(self, sock: Any) -> None:
+        for msg in sock.get_links(): self.recv(msg)
+        for msg in sock.get_addr(AF_INET): self.recv(msg)
+        for msg in sock.get_rules(AF_INET): self.recv(msg)
+        for msg in sock.get_routes(AF_INET): self.recv(msg)
+
+    def bootstrap(self, ipr: Any) -> None:
+        self.dump(ipr)
+
+    def loop(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class ResetRunner(OnceRunner):
+    route_state_class = NLResetSymmetricRouteState
+
+    def bootstrap(self, ipr: Any) -> None:
+        super().bootstrap(ipr)
+        self.route_state.commit()
+
+
+class MonitorRunner(OnceRunner):
+    monitor = None  # type: Any
+
+    def bootstrap(self, ipr: Any) -> None:
+        monitor = self.monitor = pyroute2.IPRoute()
+        # bind() takes a bitmask of RTMGRP_* groups, not RTNLGRP_* numbers.
+        monitor.bind(
+                RTMGRP_LINK|RTMGRP_IPV4_IFADDR|RTMGRP_IPV4_ROUTE|
+                RTMGRP_IPV4_RULE)
+        try:
+            monitor.setsockopt(SOL_SOCKET, SO_RCVBUFFORCE, MONITOR_RCVBUF)
+        except PermissionError:
+            monitor.setsockopt(SOL_SOCKET, SO_RCVBUF, MONITOR_RCVBUF)
+        # Dump through the monitor socket.  The groups are bound first, so
+        # updates that race the dump are held back until it's done.
+        self.sync()
+
+    def loop(self) -> None:
+        fd = self.monitor.fileno()
+        poller = select.epoll()
+        poller.register(fd, select.EPOLLIN|select.EPOLLET)
+        os.set_blocking(fd, False)
+        try:
+            while True:
+                # Edge triggered, so drain the socket (and anything held
+                # back during the dump) before waiting again.
+                try:
+                    self.drain()
+                except OSError as e:
+                    if e.errno != ENOBUFS:
+                        raise
+                    # The kernel dropped updates, start over.
+                    log.warning('Netlink receive buffer overrun, resyncing')
+                    self.sync()
+                    continue
+                poller.poll()
+
+        finally:
+            poller.close()
+
+    def drain(self) -> None:
+        try:
+            while True:
+                for msg in self.monitor.get(): self.recv(msg)
+        except BlockingIOError:
+            pass
+
+    def sync(self) -> None:
+        # Rebuild state from a full dump, retrying for as long as updates
+        # are dropped while it runs.
+        fd = self.monitor.fileno()
+        blocking = os.get_blocking(fd)
+        os.set_blocking(fd, True)
+        try:
+            while True:
+                self.link_state.reset()
+                self.route_state.reset()
+                try:
+                    self.dump(self.monitor)
+                    return
+                except OSError as e:
+                    if e.errno != ENOBUFS:
+                        raise
+                    log.warning(
+                            'Netlink receive buffer overrun during dump, '
+                            'retrying')
+        finally:
+            os.set_blocking(fd, blocking)
+
+    def close(self) -> None:
+        if self.monitor is not None:
+            self.monitor.close()
+
+
+RUNNERS = {
+        'once': OnceRunner,
+        'monitor': MonitorRunner,
+        'reset': ResetRunner,
+}
+
+
 class Link:
-    def __init__(self, **kw):
-        self.addrs = set()
-        self.update(**kw)
+    __slots__ = ('name', 'addrs', 'primary_addr', 'matches_pattern')
 
-    name = None
+    def __init__(self, **kw: Any) -> None:
+        self.name = None  # type: Optional[str]
+        self.matches_pattern = False
+        self.addrs = set()  # type: Set[IPv4Interface]
+        self.primary_addr = None  # type: Optional[IPv4Interface]
+        self.update(**kw)
 
-    def update(self, *, name=None):
+    def update(self, *, name: Optional[str] = None) -> None:
         if name is not None:
             self.name = name
 
 
-no_default = object()
-def first(seq, *, default=no_default):
-    for item in seq:
-        return item
-    if default is not no_default:
-        return default
-    raise ValueError
+def nl_batch(ipr: Any, requests: Iterable[Request], *,
+        ignore: Iterable[int] = ()) -> None:
+    """Send (msg, msg_type, msg_flags) requests back to back, then collect
+    their replies.
+
+    Every reply is drained before the first error is raised, so no stale
+    ACKs are left behind on the socket.  Errors with a code in ignore are
+    dropped.
+    """
+    seqs = []
+    error = None
+    try:
+        for msg, msg_type, msg_flags in requests:
+            seq = ipr.addr_pool.alloc()
+            seqs.append(seq)
+            ipr.put(msg, msg_type, msg_flags, msg_seq=seq)
+        for seq in seqs:
+            try:
+                # get() is a generator, it only reads when iterated.
+                for _ in ipr.get(msg_seq=seq): pass
+            except pyroute2.NetlinkError as e:
+                if error is None and e.code not in ignore:
+                    error = e
+    finally:
+        for seq in seqs:
+            ipr.addr_pool.free(seq)
+    if error is not None:
+        raise error
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+from errno import EEXIST
+from errno import ENOBUFS
+from errno import ENOENT
+from errno import EPERM
+import os
+
+import pyroute2
+import pytest
+
+import enisync
+
+
+class FakeAddrPool:
+    def __init__(self):
+        self.next = 1
+        self.allocated = set()
+
+    def alloc(self):
+        seq = self.next
+        self.next += 1
+        self.allocated.add(seq)
+        return seq
+
+    def free(self, seq):
+        self.allocated.remove(seq)
+
+
+class FakeIPRoute:
+    """Answers each request with an ACK, or the error queued for it."""
+    def __init__(self, *errors):
+        self.addr_pool = FakeAddrPool()
+        self.errors = list(errors)
+        self.sent = []
+        self.pending = {}
+        self.reads = 0
+
+    def put(self, msg, msg_type, msg_flags, msg_seq):
+        self.sent.append((msg, msg_type, msg_flags))
+        self.pending[msg_seq] = self.errors.pop(0) if self.errors else 0
+
+    def get(self, msg_seq):
+        self.reads += 1
+        code = self.pending.pop(msg_seq)
+        if code:
+            raise pyroute2.NetlinkError(code)
+        yield from ()
+
+
+def requests(n):
+    return [('msg{}'.format(i), i, 0) for i in range(n)]
+
+
+def test_nl_batch_reads_every_reply():
+    ipr = FakeIPRoute()
+    enisync.nl_batch(ipr, requests(3))
+    assert len(ipr.sent) == 3
+    assert ipr.reads == 3
+    assert not ipr.pending
+    assert not ipr.addr_pool.allocated
+
+
+def test_nl_batch_raises_first_error_after_draining():
+    ipr = FakeIPRoute(0, EEXIST, ENOENT)
+    with pytest.raises(pyroute2.NetlinkError) as exc_info:
+        enisync.nl_batch(ipr, requests(3))
+    assert exc_info.value.code == EEXIST
+    assert ipr.reads == 3
+    assert not ipr.pending
+    assert not ipr.addr_pool.allocated
+
+
+def test_nl_batch_ignores_listed_errors():
+    ipr = FakeIPRoute(ENOENT, 0)
+    enisync.nl_batch(ipr, requests(2), ignore=(ENOENT,))
+    assert ipr.reads == 2
+    assert not ipr.pending
+
+
+def reset_state(ipr):
+    link_state = enisync.NLLinkState(if_pattern=r'eth\d+')
+    route_state = enisync.NLResetSymmetricRouteState(
+            link_state, ipr=ipr, rt_table_base=10000, rule_priority_base=1000)
+    dispatcher = enisync.NLDispatcher(link_state, route_state)
+    for msg in [
+            {'event': 'RTM_NEWLINK', 'index': 2,
+                'attrs': [('IFLA_IFNAME', 'eth0')]},
+            {'event': 'RTM_NEWADDR', 'index': 2, 'family': enisync.AF_INET,
+                'prefixlen': 24, 'attrs': [('IFA_ADDRESS', '10.0.0.5')]},
+            {'event': 'RTM_NEWRULE', 'family': enisync.AF_INET, 'table': 252,
+                'attrs': [('FRA_PRIORITY', 1002), ('FRA_TABLE', 10002)]},
+            {'event': 'RTM_NEWROUTE', 'family': enisync.AF_INET, 'table': 254,
+                'dst_len': 0,
+                'attrs': [('RTA_OIF', 2), ('RTA_GATEWAY', '10.0.0.1')]}]:
+        dispatcher.recv(msg)
+    return route_state
+
+
+def test_reset_commits_teardown_in_one_batch():
+    ipr = FakeIPRoute(ENOENT)
+    route_state = reset_state(ipr)
+    assert not ipr.sent
+    route_state.commit()
+    assert [msg_type for _, msg_type, _ in ipr.sent] == [
+            enisync.RTM_DELRULE, enisync.RTM_DELROUTE]
+    assert ipr.reads == 2
+
+
+def test_reset_commit_reports_delete_failures():
+    ipr = FakeIPRoute(EPERM)
+    route_state = reset_state(ipr)
+    with pytest.raises(pyroute2.NetlinkError) as exc_info:
+        route_state.commit()
+    assert exc_info.value.code == EPERM
+    assert ipr.reads == 2
+
+
+class FakeMonitor:
+    """Dumps a single link, failing with ENOBUFS for the first overruns."""
+    def __init__(self, overruns):
+        self.overruns = overruns
+        self.dumps = 0
+        self.held = []
+        self.rfd, self.wfd = os.pipe()
+
+    def fileno(self):
+        return self.rfd
+
+    def close(self):
+        os.close(self.rfd)
+        os.close(self.wfd)
+
+    def bind(self, groups):
+        self.groups = groups
+
+    def setsockopt(self, level, optname, value):
+        pass
+
+    def get_links(self):
+        self.dumps += 1
+        yield {'event': 'RTM_NEWLINK', 'index': 2,
+                'attrs': [('IFLA_IFNAME', 'eth{}'.format(self.dumps))]}
+        if self.overruns:
+            self.overruns -= 1
+            raise OSError(ENOBUFS, 'No buffer space available')
+
+    def get_addr(self, family):
+        return []
+
+    def get(self):
+        # Hand out updates held back during the dump, then run dry.
+        held, self.held = self.held, []
+        if not held:
+            raise BlockingIOError
+        yield from held
+
+    def get_rules(self, family):
+        return []
+
+    def get_routes(self, family):
+        return []
+
+
+def test_monitor_sync_retries_dump_after_overrun():
+    link_state = enisync.NLLinkState(if_pattern=r'eth\d+')
+    route_state = enisync.NLSymmetricRouteState(
+            link_state, ipr=FakeIPRoute(),
+            rt_table_base=10000, rule_priority_base=1000)
+    runner = enisync.MonitorRunner(link_state, route_state)
+    runner.monitor = FakeMonitor(overruns=2)
+    os.set_blocking(runner.monitor.fileno(), False)
+    try:
+        runner.sync()
+        assert runner.monitor.dumps == 3
+        assert link_state[2].name == 'eth3'
+        assert not os.get_blocking(runner.monitor.fileno())
+    finally:
+        runner.close()
+
+
+def test_monitor_binds_rtmgrp_groups(monkeypatch):
+    monitor = FakeMonitor(overruns=0)
+    monkeypatch.setattr(enisync.pyroute2, 'IPRoute', lambda: monitor)
+    link_state = enisync.NLLinkState(if_pattern=r'eth\d+')
+    route_state = enisync.NLSymmetricRouteState(
+            link_state, ipr=FakeIPRoute(),
+            rt_table_base=10000, rule_priority_base=1000)
+    runner = enisync.MonitorRunner(link_state, route_state)
+    try:
+        runner.bootstrap(FakeIPRoute())
+        # RTMGRP_LINK|RTMGRP_IPV4_IFADDR|RTMGRP_IPV4_ROUTE|RTMGRP_IPV4_RULE
+        assert monitor.groups == 0x01|0x10|0x40|0x80
+    finally:
+        runner.close()
+
+
+def test_monitor_skips_stale_updates_after_sync():
+    link_state = enisync.NLLinkState(if_pattern=r'eth\d+')
+    route_state = enisync.NLSymmetricRouteState(
+            link_state, ipr=FakeIPRoute(),
+            rt_table_base=10000, rule_priority_base=1000)
+    runner = enisync.MonitorRunner(link_state, route_state)
+    runner.monitor = FakeMonitor(overruns=1)
+    runner.monitor.held = [
+            {'event': 'RTM_DELADDR', 'index': 2, 'family': enisync.AF_INET,
+                'prefixlen': 24, 'attrs': [('IFA_ADDRESS', '10.0.0.5')]},
+            {'event': 'RTM_DELADDR', 'index': 3, 'family': enisync.AF_INET,
+                'prefixlen': 24, 'attrs': [('IFA_ADDRESS', '10.0.1.5')]},
+            {'event': 'RTM_DELLINK', 'index': 3, 'attrs': []}]
+    try:
+        runner.sync()
+        runner.drain()
+        assert list(link_state.links) == [2]
+        assert not link_state[2].addrs
+    finally:
+        runner.close()